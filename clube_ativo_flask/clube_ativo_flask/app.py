@@ -1,12 +1,18 @@
 import os
+import shutil
+import mimetypes
+import time
+from urllib.parse import quote
 from functools import wraps
 from datetime import datetime, timezone
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, abort, make_response, send_from_directory
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 
@@ -36,12 +42,39 @@ migrate = Migrate(app, db)
 # --- CONFIGURAÇÃO DE UPLOADS ---
 UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/profile_pics')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+DEFAULT_PROFILE_PIC = 'default.jpg'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# --- ENTREGA DAS FOTOS DE PERFIL ---
+# MEDIA_SENDFILE='x-sendfile' (Apache/lighttpd) ou 'x-accel-redirect' (Nginx) faz o
+# servidor web enviar os bytes da imagem; o worker Python só responde com o cabeçalho.
+# No Nginx, MEDIA_ACCEL_PREFIX deve apontar para uma location 'internal' com 'alias'
+# para a pasta static/profile_pics.
+app.config['MEDIA_SENDFILE'] = os.getenv('MEDIA_SENDFILE', '').lower()
+if app.config['MEDIA_SENDFILE'] not in {'', 'x-sendfile', 'x-accel-redirect'}:
+    raise ValueError(f"MEDIA_SENDFILE inválido: '{app.config['MEDIA_SENDFILE']}'. Use 'x-sendfile', 'x-accel-redirect' ou deixe vazio.")
+app.config['MEDIA_ACCEL_PREFIX'] = os.getenv('MEDIA_ACCEL_PREFIX', '/protected/profile_pics/')
+app.config['USE_X_SENDFILE'] = app.config['MEDIA_SENDFILE'] == 'x-sendfile'
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def remove_profile_pic(filename):
+    # Apaga a foto antiga do disco, preservando a imagem padrão e arquivos
+    # ainda usados por outro usuário (nomes podem colidir após o secure_filename)
+    if not filename or filename == DEFAULT_PROFILE_PIC:
+        return
+    if User.query.filter_by(image_file=filename).first() is not None:
+        return
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if path and os.path.isfile(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            # Não derruba a requisição: o 'flask media gc' recolhe o arquivo depois
+            app.logger.warning(f"Não foi possível remover a foto '{filename}': {e}")
+
 # --- 3. MODELOS DA BASE DE DADOS ---
 # ... (Seus modelos continuam os mesmos) ...
 inscricao_evento_tabela = db.Table('inscricao_evento',
@@ -185,9 +218,11 @@ def delete_account():
         flash('Senha incorreta. A exclusão da conta foi cancelada.', 'danger')
         return redirect(url_for('account'))
     user_to_delete = g.user
+    old_image_file = user_to_delete.image_file
     session.clear()
     db.session.delete(user_to_delete)
     db.session.commit()
+    remove_profile_pic(old_image_file)
     flash('Sua conta foi excluída permanentemente.', 'info')
     return redirect(url_for('login'))
 @app.route('/register', methods=['GET', 'POST'])
@@ -249,8 +284,12 @@ def account():
             file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
             
             # Atualiza o nome do arquivo no banco de dados
+            old_image_file = g.user.image_file
             g.user.image_file = filename
             db.session.commit()
+            # Remove a foto anterior se a extensão mudou (senão ela ficaria órfã)
+            if old_image_file != filename:
+                remove_profile_pic(old_image_file)
             flash('Foto de perfil atualizada com sucesso!', 'success')
             return redirect(url_for('account'))
         else:
@@ -258,9 +297,25 @@ def account():
             return redirect(url_for('account'))
 
     # Esta parte lida com a requisição GET (carregamento normal da página)
-    image_file = url_for('static', filename='profile_pics/' + g.user.image_file)
+    image_file = url_for('profile_pic', filename=g.user.image_file)
     return render_template('account.html', image_file=image_file, eventos=g.user.eventos_inscritos)
 
+# ROTA DAS FOTOS DE PERFIL
+@app.route('/media/profile_pics/<path:filename>')
+def profile_pic(filename):
+    if app.config['MEDIA_SENDFILE'] == 'x-accel-redirect':
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        # O Nginx intercepta este cabeçalho e envia o arquivo por conta própria;
+        # o nome vai codificado porque o Nginx decodifica a URL do cabeçalho
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+        response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return response
+    # Com USE_X_SENDFILE ativo, o Flask responde apenas com o cabeçalho X-Sendfile
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
 # ROTAS PRINCIPAIS DA APLICAÇÃO
 @app.route('/noticias')
 @login_required
@@ -377,5 +432,71 @@ def seed_db_command():
     print("Notícias criadas.")
     print("Banco de dados populado com sucesso!")
 
+# COMANDOS DE MANUTENÇÃO DAS MÍDIAS
+media_cli = AppGroup('media', help='Manutenção dos arquivos enviados pelos usuários.')
+
+@media_cli.command('gc')
+@click.option('--archive', 'archive_dir', type=click.Path(file_okay=False), default=None,
+              help='Move os arquivos órfãos para esta pasta em vez de apagá-los.')
+@click.option('--min-age', type=click.IntRange(min=0), default=60, show_default=True,
+              help='Ignora arquivos modificados há menos de N minutos (uploads em andamento).')
+@click.option('--dry-run', is_flag=True, help='Apenas lista os arquivos órfãos, sem alterar nada.')
+@click.option('--force', is_flag=True, help='Prossegue mesmo se o banco não tiver nenhum usuário.')
+def media_gc_command(archive_dir, min_age, dry_run, force):
+    """Apaga fotos de perfil que nenhum usuário referencia (--archive move em vez de apagar, --dry-run só lista)."""
+    # Carrega de uma vez só os nomes de arquivo referenciados no banco
+    referenciados = {image_file for (image_file,) in db.session.query(User.image_file).distinct()}
+    # Banco vazio costuma indicar DATABASE_URL errado: todas as fotos pareceriam órfãs
+    if not referenciados and not dry_run and not force:
+        print("Nenhum usuário encontrado no banco de dados. Abortando (use --force para prosseguir).")
+        return
+    referenciados.add(DEFAULT_PROFILE_PIC)
+    if archive_dir and not dry_run:
+        os.makedirs(archive_dir, exist_ok=True)
+    limite = time.time() - min_age * 60
+    total = 0
+    falhas = 0
+    # os.scandir percorre a pasta sob demanda, sem montar a lista inteira em memória
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entradas:
+        for entrada in entradas:
+            if not entrada.is_file() or entrada.name.startswith('.') or entrada.name in referenciados:
+                continue
+            if entrada.stat().st_mtime > limite:
+                continue
+            total += 1
+            if dry_run:
+                print(f"Órfão: {entrada.name}")
+            elif archive_dir:
+                # Não sobrescreve cópias de execuções anteriores: acrescenta um carimbo de data
+                destino = os.path.join(archive_dir, entrada.name)
+                if os.path.exists(destino):
+                    nome, ext = os.path.splitext(entrada.name)
+                    carimbo = datetime.now().strftime('%Y%m%d%H%M%S')
+                    destino = os.path.join(archive_dir, f"{nome}_{carimbo}{ext}")
+                    contador = 1
+                    while os.path.exists(destino):
+                        destino = os.path.join(archive_dir, f"{nome}_{carimbo}_{contador}{ext}")
+                        contador += 1
+                try:
+                    shutil.move(entrada.path, destino)
+                except OSError as e:
+                    falhas += 1
+                    print(f"Falha ao arquivar {entrada.name}: {e}")
+                    continue
+                print(f"Arquivado: {entrada.name} -> {os.path.basename(destino)}")
+            else:
+                try:
+                    os.remove(entrada.path)
+                except OSError as e:
+                    falhas += 1
+                    print(f"Falha ao remover {entrada.name}: {e}")
+                    continue
+                print(f"Removido: {entrada.name}")
+    print(f"{total} arquivo(s) órfão(s) encontrado(s).")
+    if falhas:
+        print(f"{falhas} arquivo(s) não puderam ser processados.")
+
+app.cli.add_command(media_cli)
+
 if __name__ == '__main__':
     app.run(debug=True)